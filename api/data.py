@@ -4,13 +4,28 @@ Simple read access to stored health data.
 """
 from http.server import BaseHTTPRequestHandler
 from upstash_redis import Redis
-from datetime import datetime, timedelta
+from datetime import date
 from urllib.parse import parse_qs, urlparse
-import json
+import hmac
 import os
 
+try:
+    import orjson
+    json_loads = orjson.loads
+
+    def json_dumps(obj, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+except ImportError:  # plain json is slower but always available
+    import json
+    json_loads = json.loads
+
+    def json_dumps(obj, indent: bool = False) -> bytes:
+        return json.dumps(obj, indent=2 if indent else None).encode()
+
 API_KEY = os.environ.get("API_KEY", "")
+EXPECTED_AUTH = f"Bearer {API_KEY}".encode() if API_KEY else None
 
+# Module-level so warm invocations reuse the client's keep-alive HTTP connection
 redis = Redis(
     url=os.environ.get("UPSTASH_REDIS_REST_URL"),
     token=os.environ.get("UPSTASH_REDIS_REST_TOKEN")
@@ -18,33 +33,63 @@ redis = Redis(
 
 
 def check_auth(headers) -> bool:
-    if not API_KEY:
+    if EXPECTED_AUTH is None:
         return True
-    auth = headers.get("Authorization", "")
-    return auth == f"Bearer {API_KEY}"
+    auth = headers.get("Authorization", "").encode()
+    return hmac.compare_digest(auth, EXPECTED_AUTH)
+
+
+def get_health_days(dates: list) -> dict:
+    """
+    Fetch the requested days in two pipelined round-trips, however many there are.
+    Days stored before the switch to hashes are still single JSON blobs, so key
+    types are read first and each day is fetched with HGETALL or GET to match.
+    """
+    if not dates:
+        return {}
+    keys = [f"health:{day}" for day in dates]
+    pipeline = redis.pipeline()
+    for key in keys:
+        pipeline.type(key)
+    stored = [(day, key, kind) for day, key, kind in zip(dates, keys, pipeline.exec())
+              if kind in ("hash", "string")]
+    if not stored:
+        return {}
+
+    for _, key, kind in stored:
+        if kind == "hash":
+            pipeline.hgetall(key)
+        else:
+            pipeline.get(key)
+    results = {}
+    for (day, _, kind), value in zip(stored, pipeline.exec()):
+        data = json_loads(value) if kind == "string" else {k: json_loads(v) for k, v in value.items()}
+        if data:
+            results[day] = data
+    return results
 
 
 class handler(BaseHTTPRequestHandler):
+    def send_json(self, data: dict, status: int = 200, indent: bool = False):
+        payload = json_dumps(data, indent=indent)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
     def do_GET(self):
         if not check_auth(self.headers):
-            self.send_response(401)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "unauthorized"}).encode())
+            self.send_json({"error": "unauthorized"}, 401)
             return
 
         parsed = urlparse(self.path)
         query = parse_qs(parsed.query)
         days = int(query.get("days", [7])[0])
 
-        results = {}
-        for i in range(days):
-            date = (datetime.now() - timedelta(days=i)).strftime("%Y-%m-%d")
-            data = redis.get(f"health:{date}")
-            if data:
-                results[date] = json.loads(data)
+        # Day ordinals + isoformat build the keys without per-day strftime calls
+        today = date.today().toordinal()
+        dates = [date.fromordinal(today - i).isoformat() for i in range(days)]
+        results = get_health_days(dates)
 
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(results, indent=2).encode())
+        self.send_json(results, indent=True)
@@ -3,14 +3,42 @@ Health data ingestion endpoint.
 Receives data from iOS Shortcuts and stores in Redis.
 """
 from http.server import BaseHTTPRequestHandler
-from urllib.parse import parse_qs, unquote
+from urllib.parse import parse_qsl, unquote
+from collections import Counter
 from upstash_redis import Redis
-from datetime import datetime, timezone, timedelta
-import json
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import hmac
+import numpy as np
 import os
+import re
+import tempfile
+import warnings
+
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:  # stdlib fallback keeps the endpoint working without orjson
+    import json
+    json_loads = json.loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+# Serverless bundles are read-only, so point numba's on-disk cache at /tmp
+os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "numba"))
+try:
+    from numba import njit
+except ImportError:  # optional: reducers run as plain Python without it
+    njit = None
 
 API_KEY = os.environ.get("API_KEY", "")
+EXPECTED_AUTH = f"Bearer {API_KEY}".encode() if API_KEY else None
 
+PACIFIC_TZ = ZoneInfo("America/Los_Angeles")
+
+# Module-level so warm invocations reuse the client's keep-alive HTTP connection
 redis = Redis(
     url=os.environ.get("UPSTASH_REDIS_REST_URL"),
     token=os.environ.get("UPSTASH_REDIS_REST_TOKEN")
@@ -19,61 +47,111 @@ redis = Redis(
 
 def get_pacific_now():
     """Get current time in Pacific timezone (PST/PDT)."""
-    pacific_tz = timezone(timedelta(hours=-8))  # PST
-    return datetime.now(pacific_tz)
+    return datetime.now(PACIFIC_TZ)
+
+
+# Below this many samples numba dispatch overhead costs more than it saves
+JIT_MIN_SAMPLES = 500
+
+
+def numeric_kernel(fn):
+    """
+    Compile a numeric reducer with numba when it is installed.
+    Small inputs keep running the plain Python version on native floats.
+    """
+    compiled = njit(cache=True)(fn) if njit is not None else None
+
+    def run(*series):
+        if compiled is not None and len(series[0]) > JIT_MIN_SAMPLES:
+            return compiled(*series)
+        return fn(*[s.tolist() for s in series])
+
+    return run
 
 
 def check_auth(headers) -> bool:
-    if not API_KEY:
+    if EXPECTED_AUTH is None:
         return True
-    auth = headers.get("Authorization", "")
-    return auth == f"Bearer {API_KEY}"
+    auth = headers.get("Authorization", "").encode()
+    return hmac.compare_digest(auth, EXPECTED_AUTH)
+
+
+LINE_BREAKS = re.compile(r"[\r\n]+")
+
 
+def try_float(value: str):
+    """Convert a sample to float, keeping non-numeric values (sleep stages) as text."""
+    try:
+        return float(value)
+    except ValueError:
+        return value
 
-def parse_values(raw: str) -> list:
-    """Parse newline-separated values from iOS Shortcuts."""
-    decoded = unquote(raw).replace("\r\n", "\n").replace("\r", "\n")
-    values = []
-    for v in decoded.split("\n"):
-        v = v.strip()
-        if v:
+
+def parse_values(raw: str):
+    """
+    Parse newline-separated values from iOS Shortcuts.
+    All-numeric payloads are returned as a float64 array, mixed ones as a list.
+    """
+    decoded = unquote(raw)
+    if "\r" in decoded:
+        decoded = LINE_BREAKS.sub("\n", decoded)
+
+    # Fast path: one number per line is parsed in C by numpy. Spaces, blank
+    # lines or any non-numeric line make the counts disagree, so fall back.
+    stripped = decoded.strip()
+    if stripped and " " not in stripped and "\t" not in stripped:
+        with warnings.catch_warnings():
+            # Older numpy warns and returns a partial array on bad input
+            warnings.simplefilter("error", DeprecationWarning)
             try:
-                values.append(float(v))
-            except ValueError:
-                values.append(v)
-    return values
+                nums = np.fromstring(stripped, dtype=np.float64, sep="\n")
+            except (ValueError, DeprecationWarning):
+                nums = None
+        if nums is not None and nums.size == stripped.count("\n") + 1:
+            return nums
+
+    return [try_float(v) for v in map(str.strip, LINE_BREAKS.split(decoded)) if v]
 
 
-def compute_hr_zones(values: list) -> dict:
+def numeric(values) -> np.ndarray:
+    """
+    Numeric samples as a float64 array.
+    Arrays from the parse_values fast path are returned as-is; only mixed
+    lists are filtered, and each compute_* function does that once.
+    """
+    if isinstance(values, np.ndarray):
+        return values
+    return np.fromiter((v for v in values if isinstance(v, (int, float))), dtype=np.float64)
+
+
+HR_ZONES = (
+    "rest",      # < 100 bpm
+    "light",     # 100-120 bpm (yoga, walking)
+    "moderate",  # 120-140 bpm (strength, easy cardio)
+    "hard",      # 140-160 bpm (tempo, harder cardio)
+    "max"        # 160+ bpm (intervals, sprints)
+)
+HR_ZONE_EDGES = (100, 120, 140, 160)
+
+
+def compute_hr_zones(nums: np.ndarray) -> dict:
     """
     Calculate time spent in each heart rate zone.
     Zones based on typical training thresholds.
+    Takes the numeric array compute_stats already built, so nothing is re-filtered.
     """
-    nums = [v for v in values if isinstance(v, (int, float))]
-    if not nums:
+    if not nums.size:
         return {}
 
-    zones = {
-        "rest": 0,      # < 100 bpm
-        "light": 0,     # 100-120 bpm (yoga, walking)
-        "moderate": 0,  # 120-140 bpm (strength, easy cardio)
-        "hard": 0,      # 140-160 bpm (tempo, harder cardio)
-        "max": 0        # 160+ bpm (intervals, sprints)
-    }
+    # Heart rate fits in a byte. Truncating keeps each sample on the same side
+    # of the integer edges, and fmin/fmax send NaN to the top zone as before.
+    # Branchless uint8 compares let numpy test 16-32 samples per SIMD instruction.
+    hr = np.fmax(np.fmin(nums, 255), 0).astype(np.uint8)
+    below = [np.count_nonzero(hr < edge) for edge in HR_ZONE_EDGES]
+    counts = np.diff([0, *below, hr.size])
+    zones = dict(zip(HR_ZONES, counts.tolist()))
 
-    for hr in nums:
-        if hr < 100:
-            zones["rest"] += 1
-        elif hr < 120:
-            zones["light"] += 1
-        elif hr < 140:
-            zones["moderate"] += 1
-        elif hr < 160:
-            zones["hard"] += 1
-        else:
-            zones["max"] += 1
-
-    total = len(nums)
+    total = nums.size
     return {
         "zones": zones,
         "zone_pct": {k: round(v / total * 100) for k, v in zones.items()},
@@ -82,23 +160,33 @@ def compute_hr_zones(values: list) -> dict:
     }
 
 
+def sleep_stage(value: str):
+    """Map an Apple Health sleep value to REM/Core/Deep/Awake, or None."""
+    if "REM" in value:
+        return "REM"
+    if "Core" in value or "Light" in value:
+        return "Core"
+    if "Deep" in value:
+        return "Deep"
+    if "Awake" in value or "Wake" in value:
+        return "Awake"
+    return None
+
+
 def compute_sleep_stats(values: list) -> dict:
     """Analyze sleep stage distribution."""
     stages = {"REM": 0, "Core": 0, "Deep": 0, "Awake": 0}
-    for v in values:
+    # A night has hundreds of samples but only a handful of distinct stage
+    # strings, so classify each distinct value once
+    for v, n in Counter(values).items():
         if isinstance(v, str):
-            if "REM" in v:
-                stages["REM"] += 1
-            elif "Core" in v or "Light" in v:
-                stages["Core"] += 1
-            elif "Deep" in v:
-                stages["Deep"] += 1
-            elif "Awake" in v or "Wake" in v:
-                stages["Awake"] += 1
+            stage = sleep_stage(v)
+            if stage:
+                stages[stage] += n
 
     total = sum(stages.values())
     if total == 0:
-        return {"values": values}
+        return {"values": values.tolist() if isinstance(values, np.ndarray) else values}
 
     fragmentation = round(stages["Awake"] / total * 100, 1)
     quality = "good" if fragmentation < 20 and stages["REM"] > 0 and stages["Deep"] > 0 else \
@@ -113,161 +201,246 @@ def compute_sleep_stats(values: list) -> dict:
     }
 
 
+@numeric_kernel
+def _blood_pressure_reduce(systolic_nums, diastolic_nums):
+    """Pair readings and reduce both series in one pass."""
+    count = min(len(systolic_nums), len(diastolic_nums))
+    systolic_sum = diastolic_sum = 0.0
+    systolic_min = diastolic_min = np.inf
+    systolic_max = diastolic_max = -np.inf
+    elevated = 0
+    for i in range(count):
+        systolic = systolic_nums[i]
+        diastolic = diastolic_nums[i]
+        systolic_sum += systolic
+        diastolic_sum += diastolic
+        if systolic < systolic_min:
+            systolic_min = systolic
+        if systolic > systolic_max:
+            systolic_max = systolic
+        if diastolic < diastolic_min:
+            diastolic_min = diastolic
+        if diastolic > diastolic_max:
+            diastolic_max = diastolic
+        if systolic >= 140 or diastolic >= 90:
+            elevated += 1
+    return (count, systolic_sum, systolic_min, systolic_max,
+            diastolic_sum, diastolic_min, diastolic_max, elevated)
+
+
 def compute_blood_pressure_stats(systolic_values: list, diastolic_values: list) -> dict:
     """
     Compute blood pressure statistics from paired systolic/diastolic readings.
     Threshold: systolic ≥140 OR diastolic ≥90 mmHg (traditional hypertension).
     """
-    systolic_nums = [v for v in systolic_values if isinstance(v, (int, float))]
-    diastolic_nums = [v for v in diastolic_values if isinstance(v, (int, float))]
+    systolic_nums = numeric(systolic_values)
+    diastolic_nums = numeric(diastolic_values)
 
-    if not systolic_nums or not diastolic_nums:
+    if not systolic_nums.size or not diastolic_nums.size:
         return {"count": 0}
 
-    # Ensure equal number of readings (pair them)
-    count = min(len(systolic_nums), len(diastolic_nums))
-    systolic_nums = systolic_nums[:count]
-    diastolic_nums = diastolic_nums[:count]
-
-    # Count elevated readings
-    elevated = sum(1 for s, d in zip(systolic_nums, diastolic_nums) if s >= 140 or d >= 90)
+    (count, systolic_sum, systolic_min, systolic_max,
+     diastolic_sum, diastolic_min, diastolic_max, elevated) = _blood_pressure_reduce(systolic_nums, diastolic_nums)
 
     return {
-        "systolic_avg": round(sum(systolic_nums) / count, 1),
-        "systolic_min": round(min(systolic_nums), 1),
-        "systolic_max": round(max(systolic_nums), 1),
-        "diastolic_avg": round(sum(diastolic_nums) / count, 1),
-        "diastolic_min": round(min(diastolic_nums), 1),
-        "diastolic_max": round(max(diastolic_nums), 1),
+        "systolic_avg": round(systolic_sum / count, 1),
+        "systolic_min": round(systolic_min, 1),
+        "systolic_max": round(systolic_max, 1),
+        "diastolic_avg": round(diastolic_sum / count, 1),
+        "diastolic_min": round(diastolic_min, 1),
+        "diastolic_max": round(diastolic_max, 1),
         "count": count,
         "elevated_readings": elevated
     }
 
 
+@numeric_kernel
+def _blood_glucose_reduce(nums):
+    """Single pass: running total, Welford variance, min/max and range count."""
+    count = 0
+    total = mean = m2 = 0.0
+    low, high = np.inf, -np.inf
+    in_range = 0
+    for v in nums:
+        count += 1
+        total += v
+        delta = v - mean
+        mean += delta / count
+        m2 += delta * (v - mean)
+        if v < low:
+            low = v
+        if v > high:
+            high = v
+        if 70 <= v <= 180:
+            in_range += 1
+    return count, total, m2, low, high, in_range
+
+
 def compute_blood_glucose_stats(values: list) -> dict:
     """
     Compute blood glucose statistics.
     Target range: 70-180 mg/dL (standard diabetes management).
     """
-    nums = [v for v in values if isinstance(v, (int, float))]
-    if not nums:
+    nums = numeric(values)
+    if not nums.size:
         return {"count": 0}
 
-    count = len(nums)
-    avg = sum(nums) / count
-
-    # Calculate standard deviation
-    variance = sum((x - avg) ** 2 for x in nums) / count
-    std_dev = variance ** 0.5
-
-    # Calculate percentage in target range (70-180 mg/dL)
-    in_range = sum(1 for v in nums if 70 <= v <= 180)
+    count, total, m2, low, high, in_range = _blood_glucose_reduce(nums)
+    avg = total / count
+    std_dev = (m2 / count) ** 0.5
     in_range_pct = round(in_range / count * 100, 1)
 
     return {
         "avg": round(avg, 1),
-        "min": round(min(nums), 1),
-        "max": round(max(nums), 1),
+        "min": round(low, 1),
+        "max": round(high, 1),
         "std_dev": round(std_dev, 1),
         "count": count,
         "in_range_pct": in_range_pct
     }
 
 
-def compute_stats(values: list, key: str = "") -> dict:
-    """Compute statistics for health samples."""
-    key_lower = key.lower().strip()
+# Metrics summarized by their own function instead of the generic avg/min/max
+METRIC_STATS = {
+    "sleep": compute_sleep_stats,
+    "bloodglucose": compute_blood_glucose_stats
+}
 
-    if key_lower == "sleep":
-        return compute_sleep_stats(values)
 
-    if key_lower == "bloodglucose":
-        return compute_blood_glucose_stats(values)
+def compute_stats(values: list, key: str = "") -> dict:
+    """
+    Compute statistics for health samples.
+    `key` is the form field name, already lowercased and stripped by the caller.
+    """
+    compute = METRIC_STATS.get(key)
+    if compute:
+        return compute(values)
 
-    nums = [v for v in values if isinstance(v, (int, float))]
-    if not nums:
+    nums = numeric(values)
+    if not nums.size:
         return {"count": len(values)}
 
     result = {
-        "avg": round(sum(nums) / len(nums), 2),
-        "min": round(min(nums), 2),
-        "max": round(max(nums), 2),
-        "count": len(nums)
+        "avg": round(float(nums.sum()) / nums.size, 2),
+        "min": round(float(nums.min()), 2),
+        "max": round(float(nums.max()), 2),
+        "count": nums.size
     }
 
     # Add HR zones for heart rate data
-    if key_lower == "heartrate":
+    if key == "heartrate":
         result["hr_zones"] = compute_hr_zones(nums)
 
     return result
 
 
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_form_fields(rfile, length: int):
+    """
+    Yield (key, value) pairs from a form-encoded body as it is read.
+    Only the field currently being read is buffered, never the whole body.
+    Same rules as parse_qs: blank values and pairs without '=' are skipped.
+    """
+    buf = bytearray()
+    remaining = length
+    while remaining > 0:
+        chunk = rfile.read(min(READ_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        # Only the new bytes can contain a separator we haven't seen yet
+        search_from = len(buf)
+        buf += chunk
+        start = 0
+        end = buf.find(b"&", search_from)
+        while end != -1:
+            yield from parse_qsl(buf[start:end].decode("utf-8"))
+            start = end + 1
+            end = buf.find(b"&", start)
+        del buf[:start]
+    if buf:
+        yield from parse_qsl(buf.decode("utf-8"))
+
+
+# Runs server-side so converting a day stored before the switch to hashes
+# (a single JSON blob) and writing this POST's fields happen atomically
+STORE_METRICS_SCRIPT = """
+if redis.call("TYPE", KEYS[1]).ok == "string" then
+    local legacy = cjson.decode(redis.call("GET", KEYS[1]))
+    redis.call("DEL", KEYS[1])
+    for field, value in pairs(legacy) do
+        redis.call("HSET", KEYS[1], field, cjson.encode(value))
+    end
+end
+return redis.call("HSET", KEYS[1], unpack(ARGV))
+"""
+
+
+def store_metrics(redis_key: str, metrics: dict):
+    """
+    Store each metric as its own field of the day's hash.
+    Only the metrics in this POST are sent; other fields are left untouched.
+    """
+    args = []
+    for k, v in metrics.items():
+        args += [k, json_dumps(v).decode()]
+    redis.eval(STORE_METRICS_SCRIPT, keys=[redis_key], args=args)
+
+
 class handler(BaseHTTPRequestHandler):
+    def send_json(self, data: dict, status: int = 200):
+        payload = json_dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
     def do_POST(self):
         if not check_auth(self.headers):
-            self.send_response(401)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "unauthorized"}).encode())
+            self.send_json({"error": "unauthorized"}, 401)
             return
 
         content_length = int(self.headers.get("Content-Length", 0))
-        body = self.rfile.read(content_length).decode("utf-8")
-
-        form_data = parse_qs(body)
-        date_key = get_pacific_now().strftime("%Y-%m-%d")
+        now = get_pacific_now()
+        date_key = now.strftime("%Y-%m-%d")
         redis_key = f"health:{date_key}"
+        health_data = {}
+        keys = []
 
-        existing = redis.get(redis_key)
-        health_data = json.loads(existing) if existing else {}
+        # Aggregate each metric as soon as its field has been read
+        systolic_values = diastolic_values = None
+        for key, raw in iter_form_fields(self.rfile, content_length):
+            if key in keys:
+                continue
+            keys.append(key)
 
-        # Check for paired blood pressure fields
-        bp_systolic_key = None
-        bp_diastolic_key = None
-        for key in form_data.keys():
-            key_lower = key.lower()
+            # Blood pressure is a paired metric, computed once both halves are in
+            key_lower = key.lower().strip()
             if "bloodpressuresystolic" in key_lower:
-                bp_systolic_key = key
+                systolic_values = parse_values(raw)
             elif "bloodpressurediastolic" in key_lower:
-                bp_diastolic_key = key
-
-        # Process blood pressure as a paired metric
-        if bp_systolic_key and bp_diastolic_key:
-            systolic_raw = form_data[bp_systolic_key][0] if form_data[bp_systolic_key] else ""
-            diastolic_raw = form_data[bp_diastolic_key][0] if form_data[bp_diastolic_key] else ""
-            systolic_values = parse_values(systolic_raw)
-            diastolic_values = parse_values(diastolic_raw)
-            health_data["bloodpressure"] = compute_blood_pressure_stats(systolic_values, diastolic_values)
+                diastolic_values = parse_values(raw)
+            else:
+                health_data[key] = compute_stats(parse_values(raw), key_lower)
 
-        # Process all other metrics normally
-        for key, values in form_data.items():
-            key_lower = key.lower()
-            # Skip blood pressure fields since they're handled separately
-            if "bloodpressuresystolic" in key_lower or "bloodpressurediastolic" in key_lower:
-                continue
-
-            raw = values[0] if values else ""
-            parsed = parse_values(raw)
-            health_data[key] = compute_stats(parsed, key)
+        if systolic_values is not None and diastolic_values is not None:
+            health_data["bloodpressure"] = compute_blood_pressure_stats(systolic_values, diastolic_values)
 
-        health_data["_updated"] = get_pacific_now().isoformat()
-        redis.set(redis_key, json.dumps(health_data))
+        health_data["_updated"] = now.isoformat()
+        store_metrics(redis_key, health_data)
 
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps({
+        self.send_json({
             "ok": True,
             "date": date_key,
-            "keys": list(form_data.keys())
-        }).encode())
+            "keys": keys
+        })
 
     def do_GET(self):
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps({
+        self.send_json({
             "endpoint": "ingest",
             "method": "POST",
             "description": "Receives health data from iOS Shortcuts"
-        }).encode())
+        })
@@ -4,8 +4,10 @@ Exposes health metrics to Claude via Model Context Protocol.
 """
 from http.server import BaseHTTPRequestHandler
 from upstash_redis import Redis
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 from urllib.parse import urlparse, parse_qs
+import hmac
 import json
 import os
 
@@ -16,6 +18,9 @@ MCP_SECRET = os.environ.get("MCP_SECRET", "")
 # If not set, Claude relies purely on HR zone data
 EXERCISE_DAYS_PER_WEEK = os.environ.get("EXERCISE_DAYS_PER_WEEK", "")
 
+PACIFIC_TZ = ZoneInfo("America/Los_Angeles")
+
+# Module-level so warm invocations reuse the client's keep-alive HTTP connection
 redis = Redis(
     url=os.environ.get("UPSTASH_REDIS_REST_URL"),
     token=os.environ.get("UPSTASH_REDIS_REST_TOKEN")
@@ -24,15 +29,14 @@ redis = Redis(
 
 def get_pacific_now():
     """Get current time in Pacific timezone (PST/PDT)."""
-    pacific_tz = timezone(timedelta(hours=-8))  # PST
-    return datetime.now(pacific_tz)
+    return datetime.now(PACIFIC_TZ)
 
 
 def check_secret(path: str) -> bool:
     if not MCP_SECRET:
         return True
     query = parse_qs(urlparse(path).query)
-    return query.get("key", [""])[0] == MCP_SECRET
+    return hmac.compare_digest(query.get("key", [""])[0].encode(), MCP_SECRET.encode())
 
 
 def parse_exercise_routine() -> dict:
@@ -50,18 +54,51 @@ def parse_exercise_routine() -> dict:
     return routine
 
 
+def get_health_days(dates: list) -> dict:
+    """
+    Fetch several days in two pipelined round-trips, however many there are.
+    Days stored before the switch to hashes are still single JSON blobs, so key
+    types are read first and each day is fetched with HGETALL or GET to match.
+    """
+    if not dates:
+        return {}
+    keys = [f"health:{day}" for day in dates]
+    pipeline = redis.pipeline()
+    for key in keys:
+        pipeline.type(key)
+    stored = [(day, key, kind) for day, key, kind in zip(dates, keys, pipeline.exec())
+              if kind in ("hash", "string")]
+    if not stored:
+        return {}
+
+    for _, key, kind in stored:
+        if kind == "hash":
+            pipeline.hgetall(key)
+        else:
+            pipeline.get(key)
+    results = {}
+    for (day, _, kind), value in zip(stored, pipeline.exec()):
+        data = json.loads(value) if kind == "string" else {k: json.loads(v) for k, v in value.items()}
+        if data:
+            results[day] = data
+    return results
+
+
 def get_health_data(date_key: str) -> dict:
-    data = redis.get(f"health:{date_key}")
-    return json.loads(data) if data else {}
+    return get_health_days([date_key]).get(date_key, {})
+
+
+def past_dates(start: int, stop: int) -> list:
+    """Pacific date keys for `start` to `stop - 1` days ago."""
+    now = get_pacific_now()
+    return [(now - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(start, stop)]
 
 
 def get_hrv_baseline(days: int = 14) -> dict:
     """Calculate HRV baseline from recent history."""
     hrv_values = []
-    for i in range(1, days + 1):
-        date = (get_pacific_now() - timedelta(days=i)).strftime("%Y-%m-%d")
-        data = get_health_data(date)
-        if data and "hrv" in data and data["hrv"].get("avg"):
+    for data in get_health_days(past_dates(1, days + 1)).values():
+        if "hrv" in data and data["hrv"].get("avg"):
             hrv_values.append(data["hrv"]["avg"])
     if not hrv_values:
         return {"baseline": None, "days": 0}
@@ -85,9 +122,7 @@ def tool_get_today() -> str:
 def tool_get_trends(days: int = 7) -> str:
     """Get raw health trends over multiple days."""
     results = {}
-    for i in range(days):
-        date = (get_pacific_now() - timedelta(days=i)).strftime("%Y-%m-%d")
-        data = get_health_data(date)
+    for date, data in get_health_days(past_dates(0, days)).items():
         if data:
             day_data = {
                 "hrv": data.get("hrv", {}).get("avg"),
@@ -211,10 +246,10 @@ def tool_get_recovery_status() -> str:
 
     # Last 3 days for training pattern context
     recent_days = {}
-    for i in range(1, 4):
-        day_key = (get_pacific_now() - timedelta(days=i)).strftime("%Y-%m-%d")
-        day_data = get_health_data(day_key)
-        summary = get_day_summary(day_data)
+    recent_dates = past_dates(1, 4)
+    recent_data = get_health_days(recent_dates)
+    for i, day_key in enumerate(recent_dates, start=1):
+        summary = get_day_summary(recent_data.get(day_key))
         if summary:
             recent_days[f"day_minus_{i}"] = summary
     if recent_days:
@@ -262,10 +297,12 @@ def handle_tool_call(name: str, args: dict) -> str:
 
 class handler(BaseHTTPRequestHandler):
     def send_json(self, data: dict, status: int = 200):
+        payload = json.dumps(data).encode()
         self.send_response(status)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+        self.wfile.write(payload)
 
     def do_GET(self):
         if not check_secret(self.path):